@@ -2,8 +2,10 @@ import pandas as pd
 from databases import Database
 import os
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import FSInputFile, InputFile
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, FSInputFile, InputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -15,6 +17,11 @@ import asyncio
 import datetime
 import shutil
 import json
+import contextvars
+import cProfile
+import io
+import pstats
+import time
 
 load_dotenv()
 
@@ -29,7 +36,135 @@ if os.getenv('DATABASE_URL'):
 else:
     DATABASE_URL = f"postgresql://{os.getenv('DB_USER', 'postgres')}:{os.getenv('DB_PASSWORD', '')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', 'orders_db')}"
 
-db = Database(DATABASE_URL)
+SLOW_UPDATE_MS = int(os.getenv("SLOW_UPDATE_MS", "0") or 0)
+
+PROFILE_MAX_SECONDS = 600
+PROFILE_MAX_UPDATES = 1000
+PROFILE_TOP = 60
+
+# Накопители времени БД/Telegram API для текущего апдейта (только при SLOW_UPDATE_MS).
+update_timings = contextvars.ContextVar("update_timings", default=None)
+profile_session = None
+
+
+class TimedDatabase(Database):
+    async def _timed(self, method, query, values):
+        timings = update_timings.get()
+        if timings is None:
+            return await method(query, values)
+        started = time.perf_counter()
+        try:
+            return await method(query, values)
+        finally:
+            timings["db"] += time.perf_counter() - started
+
+    async def execute(self, query, values=None):
+        return await self._timed(super().execute, query, values)
+
+    async def fetch_all(self, query, values=None):
+        return await self._timed(super().fetch_all, query, values)
+
+    async def fetch_one(self, query, values=None):
+        return await self._timed(super().fetch_one, query, values)
+
+
+db = TimedDatabase(DATABASE_URL)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        timings = update_timings.get()
+        if timings is None:
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            timings["api"] += time.perf_counter() - started
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        timings = update_timings.get()
+        if timings is not None:
+            timings["handler"] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class UpdateMonitorMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        session = profile_session if profile_session is not None and profile_session["updates_left"] is not None else None
+        if not SLOW_UPDATE_MS and session is None:
+            return await handler(event, data)
+
+        timings = {"db": 0.0, "api": 0.0, "handler": None}
+        token = update_timings.set(timings) if SLOW_UPDATE_MS else None
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if token is not None:
+                update_timings.reset(token)
+                if elapsed_ms >= SLOW_UPDATE_MS:
+                    print(
+                        f"🐢 Медленный апдейт: type={event.event_type} handler={timings['handler'] or '-'} "
+                        f"total={elapsed_ms:.1f}ms db={timings['db'] * 1000:.1f}ms api={timings['api'] * 1000:.1f}ms"
+                    )
+            if session is not None and session is profile_session:
+                session["updates_left"] -= 1
+                if session["updates_left"] <= 0:
+                    await finish_profiling(session)
+
+
+async def finish_profiling(session):
+    global profile_session
+    if session is None or session is not profile_session:
+        return
+    profile_session = None
+    session["profiler"].disable()
+    stopper = session["stopper"]
+    if stopper is not None and stopper is not asyncio.current_task():
+        stopper.cancel()
+
+    stream = io.StringIO()
+    stats = pstats.Stats(session["profiler"], stream=stream)
+    stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+    # Отдельно — кадры самого бота (хендлеры), без простоя event loop.
+    stats.sort_stats("cumulative").print_stats(r"bot\.py", PROFILE_TOP)
+    try:
+        await bot.send_document(
+            session["chat_id"],
+            BufferedInputFile(stream.getvalue().encode("utf-8"), filename="profile.txt"),
+            caption=f"📊 Профиль за {session['label']}",
+        )
+    except Exception as e:
+        print(f"⚠️  Не удалось отправить профиль: {e}")
+
+
+async def stop_profiling_after(session, seconds):
+    await asyncio.sleep(seconds)
+    await finish_profiling(session)
+
+
+async def timed_download(file_path, destination):
+    # download_file идёт через stream_content, мимо ApiTimingMiddleware.
+    timings = update_timings.get()
+    if timings is None:
+        return await bot.download_file(file_path, destination)
+    started = time.perf_counter()
+    try:
+        return await bot.download_file(file_path, destination)
+    finally:
+        timings["api"] += time.perf_counter() - started
+
+
+dp.update.outer_middleware(UpdateMonitorMiddleware())
+if SLOW_UPDATE_MS:
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+    bot.session.middleware(ApiTimingMiddleware())
+
 
 async def init_db():
     await db.execute("""
@@ -459,6 +594,54 @@ async def admin_back_days(callback: types.CallbackQuery):
     await callback.message.answer("Выберите день для просмотра заказов:", reply_markup=kb.as_markup())
 
 
+@dp.message(Command("profile"))
+async def profile_command(message: types.Message, command: CommandObject):
+    global profile_session
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    args = (command.args or "").split()
+    if args and args[0].lower() == "stop":
+        if profile_session is None:
+            await message.answer("Профилирование не запущено.")
+            return
+        await finish_profiling(profile_session)
+        return
+
+    if profile_session is not None:
+        await message.answer("⏳ Профилирование уже запущено. Остановить: /profile stop")
+        return
+
+    unit = args[1].lower() if len(args) > 1 else "sec"
+    by_updates = unit == "upd"
+    limit = PROFILE_MAX_UPDATES if by_updates else PROFILE_MAX_SECONDS
+    try:
+        amount = int(args[0]) if args else 30
+    except ValueError:
+        amount = 0
+    if unit not in ("sec", "upd") or amount < 1 or amount > limit:
+        await message.answer(
+            "❌ Формат: /profile [N] [sec|upd] или /profile stop\n"
+            f"N секунд (до {PROFILE_MAX_SECONDS}) или N апдейтов (до {PROFILE_MAX_UPDATES})."
+        )
+        return
+
+    profiler = cProfile.Profile()
+    profile_session = {
+        "profiler": profiler,
+        "chat_id": message.chat.id,
+        "updates_left": amount if by_updates else None,
+        "label": f"{amount} апд." if by_updates else f"{amount} сек.",
+        "stopper": None,
+    }
+    profiler.enable()
+    # Для режима апдейтов — ограничение по времени, чтобы профайлер не висел на тихом боте.
+    seconds = PROFILE_MAX_SECONDS if by_updates else amount
+    profile_session["stopper"] = asyncio.create_task(stop_profiling_after(profile_session, seconds))
+    await message.answer(f"📊 Профилирование запущено на {profile_session['label']}")
+
+
 @dp.message(F.document)
 async def update_menu(message: types.Message):
     if message.from_user.id not in ADMIN_IDS:
@@ -476,7 +659,7 @@ async def update_menu(message: types.Message):
         file_path = f"downloads/{file_name}"
 
         os.makedirs("downloads", exist_ok=True)
-        await bot.download_file(file.file_path, file_path)
+        await timed_download(file.file_path, file_path)
         
         xls = pd.ExcelFile(file_path)
         df = pd.read_excel(xls, xls.sheet_names[0], header=None)
@@ -645,6 +828,7 @@ if __name__ == "__main__":
             print(f"   - DATABASE_URL (или DB_* переменные, обязательно)")
             print(f"   - WEBHOOK_URL (опционально, если не установлен, будет использован polling)")
             print(f"   - PORT (опционально, default: 8000)")
+            print(f"   - SLOW_UPDATE_MS (опционально, порог лога медленных апдейтов в мс, 0 — выключен)")
             raise
         finally:
             try: